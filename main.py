@@ -1,15 +1,120 @@
+import hashlib
 import json
+import os
 import requests
-import time
 import re
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 并发下载源的最大线程数
+FETCH_WORKERS = 16
+
+# 同一主机两次请求之间的最小间隔（秒），不同主机互不影响
+HOST_INTERVAL = 1.0
+_host_next_slot = {}  # 主机到下一次允许请求时间的映射
+_host_lock = threading.Lock()
+
+# 源数据本地缓存目录及有效期（秒），过期后用ETag/Last-Modified发送条件请求
+CACHE_DIR = '.cache'
+CACHE_TTL = 3600
+
+# 共享的HTTP会话，复用连接并对临时错误自动重试
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32,
+                       max_retries=Retry(total=2, backoff_factor=0.3))
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
+
+# 预编译的元数据正则
+# 一次扫描同时匹配group-title、tvg-name属性（连同其后的空白）及空白段
+ENTRY_ATTRS_RE = re.compile(r'group-title=[\'"]([^\'"]*)[\'"]\s*|tvg-name="([^"]*)"\s*|\s+')
+WORD_RE = re.compile(r'\w+')
+# #EXTINF行及紧随其后的URL行（非空且不以#开头）
+EXTINF_RE = re.compile(r'^(#EXTINF[^\r\n]*)\r?\n[ \t]*([^#\s][^\r\n]*)', re.MULTILINE)
+
+
+def cache_paths(url):
+    """返回URL对应的缓存内容文件和缓存信息文件路径"""
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, f'{key}.m3u'), os.path.join(CACHE_DIR, f'{key}.json')
+
+
+def load_cached_m3u(url):
+    """读取缓存的M3U内容及缓存信息，没有缓存时返回(None, {})"""
+    body_path, info_path = cache_paths(url)
+    try:
+        with open(body_path, 'r', encoding='utf-8') as f:
+            m3u_text = f.read()
+        with open(info_path, 'r', encoding='utf-8') as f:
+            cache_info = json.load(f)
+        return m3u_text, cache_info
+    except (OSError, ValueError):
+        return None, {}
+
+
+def save_cached_m3u(url, cache_info, m3u_text=None):
+    """保存缓存信息，m3u_text不为None时同时保存M3U内容"""
+    body_path, info_path = cache_paths(url)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        if m3u_text is not None:
+            with open(body_path, 'w', encoding='utf-8') as f:
+                f.write(m3u_text)
+        with open(info_path, 'w', encoding='utf-8') as f:
+            json.dump(cache_info, f)
+    except OSError as e:
+        print(f"⚠️ 写入缓存失败: {url} - {str(e)}")
+
+
+def wait_for_host(url):
+    """按主机限速：为本次请求预约时间段，距同一主机上次请求不足HOST_INTERVAL时等待"""
+    host = urlsplit(url).netloc
+    with _host_lock:
+        now = time.monotonic()
+        slot = max(now, _host_next_slot.get(host, now))
+        _host_next_slot[host] = slot + HOST_INTERVAL
+    if slot > now:
+        time.sleep(slot - now)
 
 
 def fetch_raw_m3u(url):
-    """从指定URL获取M3U内容"""
+    """从指定URL获取M3U内容，优先使用本地缓存"""
+    cached_text, cache_info = load_cached_m3u(url)
+
+    # 缓存未过期，直接使用
+    if cached_text is not None and time.time() - cache_info.get('fetched_at', 0) < CACHE_TTL:
+        return cached_text
+
+    # 缓存已过期，发送条件请求
+    headers = {}
+    if cached_text is not None:
+        if cache_info.get('etag'):
+            headers['If-None-Match'] = cache_info['etag']
+        if cache_info.get('last_modified'):
+            headers['If-Modified-Since'] = cache_info['last_modified']
+
     try:
-        response = requests.get(url, timeout=10)
+        # 避免对同一主机请求过快
+        wait_for_host(url)
+        response = SESSION.get(url, headers=headers, timeout=10)
         response.raise_for_status()
+        new_info = {
+            'etag': response.headers.get('ETag', cache_info.get('etag')),
+            'last_modified': response.headers.get('Last-Modified', cache_info.get('last_modified')),
+            'fetched_at': time.time(),
+        }
+
+        # 内容未修改，继续使用缓存
+        if response.status_code == 304 and cached_text is not None:
+            save_cached_m3u(url, new_info)
+            return cached_text
+
+        save_cached_m3u(url, new_info, response.text)
         return response.text
     except Exception as e:
         print(f"⚠️ 获取源数据失败: {url} - {str(e)}")
@@ -17,40 +122,23 @@ def fetch_raw_m3u(url):
 
 
 def parse_m3u(m3u_text):
-    """解析M3U文本，返回频道元数据和URL的列表"""
-    parsed_channels = []
-    lines = m3u_text.strip().splitlines()
-
+    """解析M3U文本，逐个生成(元数据, URL)元组"""
     # 检查是否是有效的M3U文件
-    if not lines or not lines[0].startswith("#EXTM3U"):
+    if not m3u_text.lstrip().startswith("#EXTM3U"):
         print("❌ 无效的M3U文件格式")
-        return parsed_channels
-
-    i = 0
-    while i < len(lines):
-        if lines[i].startswith("#EXTINF"):
-            # 保存原始元数据行
-            metadata = lines[i]
-            url = ""
-
-            # 下一个应该是URL
-            if i + 1 < len(lines) and not lines[i + 1].startswith("#"):
-                url = lines[i + 1].strip()
-                parsed_channels.append({
-                    "metadata": metadata,
-                    "url": url
-                })
-                i += 1  # 跳过URL行
-        i += 1
+        return
 
-    return parsed_channels
+    # 按需用正则扫描出#EXTINF行及其URL，调用方提前结束时不再解析剩余内容
+    for match in EXTINF_RE.finditer(m3u_text):
+        yield match.group(1), match.group(2).rstrip()
 
 
 def load_json_data(filename):
     """从JSON文件加载数据"""
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        # 以二进制读取，由json.loads直接解码UTF-8
+        with open(filename, 'rb') as f:
+            return json.loads(f.read())
     except Exception as e:
         print(f"⚠️ 加载JSON文件失败 {filename}: {str(e)}")
         return None
@@ -111,9 +199,57 @@ def load_sources():
     return sources
 
 
-def is_channel_match(channel_name, metadata):
+def compile_channel_matchers(channel_list):
     """
-    精确匹配频道名称（忽略大小写）
+    为每个频道预先准备匹配数据，返回频道名称到(小写名称, 单词边界匹配正则)的映射
+    正则由小写的频道名称构建，用于匹配已转为小写的元数据，无需re.IGNORECASE
+    """
+    matchers = {}
+    for name in channel_list:
+        name_lower = name.lower()
+        matchers[name] = (name_lower, re.compile(rf'\b{re.escape(name_lower)}\b'))
+    return matchers
+
+
+def channel_index_key(channel_name):
+    """
+    返回频道名称的索引词（小写的第一个单词）
+    匹配要求频道名称两侧是单词边界，因此该词一定作为完整单词出现在匹配的元数据中；
+    名称不以单词字符开头时返回None，表示需要检查所有条目
+    """
+    match = WORD_RE.match(channel_name.lower())
+    return match.group(0) if match else None
+
+
+def build_channel_index(channels):
+    """建立索引词到频道名称列表的映射，返回(映射, 没有索引词的频道列表)"""
+    channels_by_key = defaultdict(list)
+    unkeyed_channels = []
+    for name in channels:
+        key = channel_index_key(name)
+        if key:
+            channels_by_key[key].append(name)
+        else:
+            unkeyed_channels.append(name)
+    return channels_by_key, unkeyed_channels
+
+
+def extract_attr(metadata, prefix):
+    """用字符串查找提取属性值，prefix形如'tvg-id="'，属性不存在时返回None"""
+    start = metadata.find(prefix)
+    if start < 0:
+        return None
+    start += len(prefix)
+    end = metadata.find('"', start)
+    if end < 0:
+        return None
+    return metadata[start:end]
+
+
+def is_channel_match(metadata, name_lower, word_re):
+    """
+    精确匹配频道名称（忽略大小写），metadata为小写的元数据，
+    name_lower和word_re为compile_channel_matchers准备的小写频道名称及其正则
     匹配规则（按优先级排序）：
     1. 检查tvg-id属性是否匹配频道名称
     2. 检查tvg-name属性是否匹配频道名称
@@ -121,39 +257,37 @@ def is_channel_match(channel_name, metadata):
     4. 避免部分匹配（如"CCTV1"不应匹配"CCTV10"）
     """
     # 1. 匹配tvg-id属性（最高优先级）
-    tvg_id_match = re.search(r'tvg-id="([^"]*)"', metadata, re.IGNORECASE)
-    if tvg_id_match:
-        tvg_id = tvg_id_match.group(1)
-        # 精确匹配tvg-id（使用正则忽略大小写）
-        if re.fullmatch(re.escape(channel_name), tvg_id, re.IGNORECASE):
+    tvg_id = extract_attr(metadata, 'tvg-id="')
+    if tvg_id is not None:
+        # 精确匹配tvg-id
+        if tvg_id == name_lower:
             return True
         # 检查tvg-id是否包含频道名称（但避免部分匹配）
-        if re.search(rf'\b{re.escape(channel_name)}\b', tvg_id, re.IGNORECASE):
+        if word_re.search(tvg_id):
             return True
 
     # 2. 匹配tvg-name属性
-    tvg_name_match = re.search(r'tvg-name="([^"]*)"', metadata, re.IGNORECASE)
-    if tvg_name_match:
-        tvg_name = tvg_name_match.group(1)
-        # 精确匹配tvg-name（使用正则忽略大小写）
-        if re.fullmatch(re.escape(channel_name), tvg_name, re.IGNORECASE):
+    tvg_name = extract_attr(metadata, 'tvg-name="')
+    if tvg_name is not None:
+        # 精确匹配tvg-name
+        if tvg_name == name_lower:
             return True
         # 检查tvg-name是否包含频道名称（但避免部分匹配）
-        if re.search(rf'\b{re.escape(channel_name)}\b', tvg_name, re.IGNORECASE):
+        if word_re.search(tvg_name):
             return True
 
     # 3. 匹配元数据末尾的频道名称（逗号后的部分）
     if ',' in metadata:
         display_name = metadata.split(',')[-1].strip()
-        # 精确匹配显示名称（使用正则忽略大小写）
-        if re.fullmatch(re.escape(channel_name), display_name, re.IGNORECASE):
+        # 精确匹配显示名称
+        if display_name == name_lower:
             return True
         # 检查显示名称是否包含频道名称
-        if re.search(rf'\b{re.escape(channel_name)}\b', display_name, re.IGNORECASE):
+        if word_re.search(display_name):
             return True
 
     # 4. 在整个元数据中搜索（作为最后的手段）
-    if re.search(rf'\b{re.escape(channel_name)}\b', metadata, re.IGNORECASE):
+    if word_re.search(metadata):
         return True
 
     return False
@@ -162,51 +296,74 @@ def is_channel_match(channel_name, metadata):
 def find_channels(sources, channel_list):
     """在源列表中查找频道，返回查找结果"""
     found_channel_urls = defaultdict(list)  # 频道名称到URL列表的映射
+    seen_urls = defaultdict(set)  # 频道名称到已收录URL集合的映射，用于去重
+    seen_bodies = set()  # 已处理过的源内容摘要
     channel_metadata_map = {}  # 频道名称到元数据的映射
     found_channels = set()  # 已找到的频道
 
+    # 去重后的频道列表（保持原始顺序），匹配正则和索引只构建一次
+    channels = list(dict.fromkeys(channel_list))
+    channel_matchers = compile_channel_matchers(channels)
+    channels_by_key, unkeyed_channels = build_channel_index(channels)
+
     print("\n🔍 开始查找频道...")
 
-    for source in sources:
-        print(f"\n📡 正在搜索源: {source}")
-        m3u_text = fetch_raw_m3u(source)
-        if not m3u_text:
-            continue
-
-        # 解析当前源的M3U内容
-        source_channels = parse_m3u(m3u_text)
-
-        # 当前源中找到的新频道
-        found_in_source = []
-
-        # 查找当前源中是否有需要的频道
-        for channel_name in channel_list:
-            # 在当前源的所有频道中查找匹配项
-            for entry in source_channels:
-                # 检查元数据是否包含频道名称
-                if is_channel_match(channel_name, entry["metadata"]):
-                    # 添加到找到的频道URL列表
-                    found_channel_urls[channel_name].append(entry["url"])
-
-                    # 保存元数据（如果还没有保存过）
-                    if channel_name not in channel_metadata_map:
-                        channel_metadata_map[channel_name] = entry["metadata"]
-
-                    # 标记为已找到
-                    if channel_name not in found_channels:
-                        found_channels.add(channel_name)
-                        found_in_source.append(channel_name)
+    # 并发下载所有源；map按源的原始顺序返回结果，
+    # 前面的源一下载完就开始匹配，与其余源的下载重叠进行
+    with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(sources))) as executor:
+        for source, m3u_text in zip(sources, executor.map(fetch_raw_m3u, sources)):
+            print(f"\n📡 正在搜索源: {source}")
+            if not m3u_text:
+                continue
+
+            # 与之前某个源内容完全相同（镜像源）时不会找到新的URL，跳过解析
+            body_digest = hashlib.sha1(m3u_text.encode('utf-8')).digest()
+            if body_digest in seen_bodies:
+                print("⚠️ 此源内容与之前的源相同，已跳过")
+                continue
+            seen_bodies.add(body_digest)
+
+            # 当前源中尚未匹配的频道，每个频道只取第一个匹配的条目
+            remaining = set(channels)
+
+            # 每个条目只扫描一遍，只检查索引词出现在元数据中的频道
+            for metadata, url in parse_m3u(m3u_text):
+                # 当前源中所有频道都已匹配，无需继续扫描
+                if not remaining:
                     break
 
-        # 输出当前源中找到的频道
-        if found_in_source:
-            channels_str = ", ".join(found_in_source)
-            print(f"✅ 找到频道: {channels_str}")
-        else:
-            print("⚠️ 在此源中未找到新频道")
-
-        # 避免请求过快
-        time.sleep(1)
+                # 每个条目只转换一次小写，之后的匹配都区分大小写
+                metadata_lower = metadata.lower()
+                tokens = set(WORD_RE.findall(metadata_lower))
+                candidates = [name for token in tokens for name in channels_by_key.get(token, ())]
+                candidates.extend(unkeyed_channels)
+
+                for channel_name in candidates:
+                    if channel_name not in remaining:
+                        continue
+                    if is_channel_match(metadata_lower, *channel_matchers[channel_name]):
+                        remaining.discard(channel_name)
+
+                        # 添加到找到的频道URL列表（同一URL出现在多个源中时只保留一次）
+                        if url not in seen_urls[channel_name]:
+                            seen_urls[channel_name].add(url)
+                            found_channel_urls[channel_name].append(url)
+
+                        # 保存元数据（如果还没有保存过）
+                        if channel_name not in channel_metadata_map:
+                            channel_metadata_map[channel_name] = metadata
+
+            # 当前源中找到的新频道
+            found_in_source = [name for name in channels
+                               if name not in remaining and name not in found_channels]
+            found_channels.update(found_in_source)
+
+            # 输出当前源中找到的频道
+            if found_in_source:
+                channels_str = ", ".join(found_in_source)
+                print(f"✅ 找到频道: {channels_str}")
+            else:
+                print("⚠️ 在此源中未找到新频道")
 
     # 计算缺失频道
     missing_channel_list = [ch for ch in channel_list if ch not in found_channels]
@@ -214,98 +371,59 @@ def find_channels(sources, channel_list):
     return found_channel_urls, channel_metadata_map, missing_channel_list
 
 
-def extract_tvg_name(metadata):
-    """从元数据中提取tvg-name"""
-    match = re.search(r'tvg-name="([^"]*)"', metadata)
-    if match:
-        return match.group(1)
-    return None
+def build_entry_template(metadata, group_title, channel_name):
+    """
+    一次扫描生成频道输出条目的元数据模板，返回(前缀, 后缀)，前缀+源编号+后缀即为该源的元数据行：
+    移除原有的group-title和tvg-name属性并合并空白，再在逗号前写入新的group-title
+    和带源编号的唯一tvg-name（没有tvg-name时使用频道名称）
+    """
+    original = {}
 
+    def strip_attr(match):
+        if match.group(1) is not None:
+            original.setdefault('group-title', match.group(1))
+            return ''
+        if match.group(2) is not None:
+            original.setdefault('tvg-name', match.group(2))
+            return ''
+        return ' '
 
-def set_group_title(metadata, group_title):
-    """设置或替换元数据中的group-title属性，确保完全移除原有的group-title"""
-    # 首先移除所有现有的group-title属性（包括单引号和双引号）
-    metadata = re.sub(r'group-title=[\'"][^\'"]*[\'"]', '', metadata)
-    metadata = re.sub(r'\s+', ' ', metadata).strip()
+    metadata = ENTRY_ATTRS_RE.sub(strip_attr, metadata).strip()
 
-    # 在逗号前添加新的group-title属性
-    if ',' in metadata:
-        parts = metadata.split(',', 1)
-        new_metadata = f'{parts[0]} group-title="{group_title}",{parts[1]}'
-    else:
-        new_metadata = f'{metadata} group-title="{group_title}"'
+    # 没有指定分组时保留原有的group-title
+    group_title = group_title or original.get('group-title')
+    tvg_name = original.get('tvg-name') or channel_name
 
-    return new_metadata
+    group_attr = f' group-title="{group_title}"' if group_title else ''
 
+    head, comma, tail = metadata.partition(',')
+    return f'{head.rstrip()}{group_attr} tvg-name="{tvg_name}_源', f'"{comma}{tail}'
 
-def generate_unique_tvg_name(metadata, source_index):
-    """生成唯一的tvg-name，避免重复"""
-    # 提取原始tvg-name
-    original_tvg_name = extract_tvg_name(metadata)
 
-    if original_tvg_name:
-        # 移除现有的tvg-name
-        metadata = re.sub(r'tvg-name="[^"]*"', '', metadata)
-        metadata = re.sub(r'\s+', ' ', metadata).strip()
+def generate_m3u_file(found_channel_urls, channel_list, channel_metadata_map, channel_to_group):
+    """生成最终的M3U文件，包含所有找到的频道URL"""
+    print("\n📝 生成结果文件...")
 
-        # 添加带源编号的唯一tvg-name
-        if ',' in metadata:
-            parts = metadata.split(',', 1)
-            new_metadata = f'{parts[0]} tvg-name="{original_tvg_name}_源{source_index}",{parts[1]}'
-        else:
-            new_metadata = f'{metadata} tvg-name="{original_tvg_name}_源{source_index}"'
-    else:
-        # 如果没有tvg-name，在频道名称中添加源标识
-        if ',' in metadata:
-            parts = metadata.split(',', 1)
-            new_metadata = f'{parts[0]} tvg-name="频道_源{source_index}",{parts[1]}'
-        else:
-            new_metadata = f'{metadata} tvg-name="频道_源{source_index}"'
+    # 先在内存中拼接全部内容（从M3U头部开始），最后一次性写入文件
+    parts = ["#EXTM3U\n"]
 
-    return new_metadata
+    # 按照原始顺序写入频道
+    for channel_name in channel_list:
+        if channel_name in found_channel_urls:
+            # 获取分组名称（如果有）
+            group_title = channel_to_group.get(channel_name) if channel_to_group else None
 
+            # 每个频道只生成一次元数据模板，各URL的条目只有源编号不同；
+            # 如果没有元数据，以只含频道名称的元数据行为基础
+            metadata = channel_metadata_map.get(channel_name, f'#EXTINF:-1, {channel_name}')
+            prefix, suffix = build_entry_template(metadata, group_title, channel_name)
+
+            # 为该频道的每个URL写入一个条目
+            urls = found_channel_urls[channel_name]
+            parts.extend(f"{prefix}{i}{suffix}\n{url}\n" for i, url in enumerate(urls, 1))
 
-def generate_m3u_file(found_channel_urls, channel_list, channel_metadata_map, channel_to_group):
-    """生成最终的M3U文件，包含所有找到的频道URL"""
-    print("\n📝 生成结果文件...")
     with open('simple.m3u', 'w', encoding='utf-8') as f:
-        # 写入M3U头部
-        f.write("#EXTM3U\n")
-
-        # 按照原始顺序写入频道
-        for channel_name in channel_list:
-            if channel_name in found_channel_urls:
-                # 获取分组名称（如果有）
-                group_title = channel_to_group.get(channel_name) if channel_to_group else None
-
-                # 获取该频道的所有URL
-                urls = found_channel_urls[channel_name]
-
-                # 为每个URL写入一个条目
-                for i, url in enumerate(urls):
-                    # 检查是否有元数据
-                    if channel_name in channel_metadata_map:
-                        metadata = channel_metadata_map[channel_name]
-
-                        # 如果有分组名称，设置或替换group-title
-                        if group_title:
-                            metadata = set_group_title(metadata, group_title)
-
-                        # 确保tvg-name唯一性
-                        metadata = generate_unique_tvg_name(metadata, i + 1)
-
-                        # 使用处理后的元数据格式
-                        f.write(f"{metadata}\n")
-                    else:
-                        # 如果没有元数据，创建新的元数据行
-                        if group_title:
-                            f.write(
-                                f'#EXTINF:-1 group-title="{group_title}" tvg-name="{channel_name}_源{i + 1}", {channel_name}\n')
-                        else:
-                            f.write(
-                                f'#EXTINF:-1 tvg-name="{channel_name}_源{i + 1}", {channel_name}\n')
-
-                    f.write(f"{url}\n")
+        f.write(''.join(parts))
 
 
 def print_report(found_channel_urls, channel_list, missing_channel_list):